@@ -1,94 +1,321 @@
 import os
+import sys
 import time
-import json
+import logging
 import subprocess
+import signal
+import selectors
+import threading
+import queue
+import random
+import sqlite3
+from collections import deque
 import requests
+from requests.adapters import HTTPAdapter
+import orjson
 import re
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from google import genai
 from openai import OpenAI
 
+# --- Logging ---
+# One handler, one write+flush per record (timestamps formatted by logging itself)
+logging.basicConfig(level=logging.INFO, stream=sys.stdout, format="[%(asctime)s] %(message)s", datefmt="%H:%M:%S")
+log = logging.getLogger("monitor")
+
 # --- Configuration ---
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY") # [NEW]
+AI_TIMEOUT = 10 # Seconds per AI request before we give up on that provider
 
 # --- Global Counters ---
 GEMINI_CALL_COUNT = 0
 OPENAI_CALL_COUNT = 0
 
 if not all([TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, GEMINI_API_KEY]):
-    print("FATAL: Missing API Keys (Telegram or Gemini). OpenAI is optional but recommended.")
+    log.critical("FATAL: Missing API Keys (Telegram or Gemini). OpenAI is optional but recommended.")
     exit(1)
 
 # --- Clients ---
 # 1. Gemini
 try:
-    gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+    gemini_client = genai.Client(api_key=GEMINI_API_KEY, http_options={"timeout": AI_TIMEOUT * 1000}) # ms
 except Exception as e:
-    print(f"Error init Gemini: {e}")
+    log.error(f"Error init Gemini: {e}")
 
 # 2. OpenAI [NEW]
 openai_client = None
 if OPENAI_API_KEY:
     try:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
-        print("✅ OpenAI Backup: Active")
+        openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0) # One attempt per AI_TIMEOUT, no silent retries
+        log.info("✅ OpenAI Backup: Active")
     except Exception as e:
-        print(f"⚠️ OpenAI Error: {e}")
+        log.error(f"⚠️ OpenAI Error: {e}")
+
+# 3. Telegram (keep-alive session, reuses one TLS connection)
+TG_SESSION = requests.Session()
+TG_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
 
 # --- Constants & State ---
 NAS_MOUNT_POINT = "/mnt/nas"
-CACHE_FILE = "/data/fix_cache.json" # [NEW] Persistent Brain
+HOST_MOUNTINFO = "/proc/1/mountinfo" # Host init's mount table (container runs with pid: host)
+CACHE_DB = "/data/fix_cache.db" # Persistent Brain (SQLite, WAL)
+CACHE_FILE = "/data/fix_cache.json" # Legacy JSON brain, imported once into CACHE_DB
 HEARTBEAT_FILE = "/tmp/heartbeat"
 POLL_INTERVAL = 60
+CMD_TIMEOUT = 30       # Seconds before a host command is killed
+MAX_CMD_OUTPUT = 2048  # Bytes of host command output kept in memory
 MODEL_GEMINI = "gemini-1.5-flash"
 MODEL_GPT = "gpt-3.5-turbo" # Or gpt-4o if you have budget
+HEDGE_DELAY = 2      # Seconds Gemini gets alone before ChatGPT is also asked (0 = race both)
+CPU_LOAD_MAX = 4.0   # 1-min load average (Pi 4 = 4 cores)
+MEM_USED_MAX = 90    # % of RAM in use
+DISK_USED_MAX = 90   # % of root filesystem in use
+AI_FAILURES_TO_OPEN = 3  # Consecutive all-AI failures before the breaker opens
+AI_COOLDOWN_MIN = 5      # First cooldown (minutes), doubles on each failed probe...
+AI_COOLDOWN_MAX = 15     # ...up to this cap
+TG_BATCH_WINDOW = 1.0  # Seconds to collect a burst of messages into one send
+TG_MAX_LEN = 4096      # Telegram's per-message character limit
+TG_BACKLOG_MAX = 100   # Messages held while Telegram is paused (oldest dropped)
+TG_BACKOFF_MAX = 300   # Cap (seconds) for exponential backoff on network errors
 
 # Load Cache
-FIX_CACHE = {}
+class FixCache:
+    """
+    problem_key -> fix command, backed by SQLite so each learned fix is a
+    single durable upsert instead of a full-file rewrite.
+    Cache errors are logged and never break troubleshooting (worst case: no memory).
+    """
+    def __init__(self, path):
+        try:
+            self.conn = self._open(path)
+        except sqlite3.Error as e:
+            log.error(f"Cache Open Error: {e}. Using an in-memory cache (fixes won't survive a restart).")
+            self.conn = self._open(":memory:")
+
+    @staticmethod
+    def _open(path):
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS fixes (key TEXT PRIMARY KEY, cmd TEXT, hits INT DEFAULT 0, last_used REAL)")
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def get(self, key):
+        """Learned fix for key (None if unknown or the cache can't be read)."""
+        try:
+            row = self.conn.execute("SELECT cmd FROM fixes WHERE key=?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            log.error(f"Cache Read Error: {e}")
+            return None
+        if row is None: return None
+        try: self.conn.execute("UPDATE fixes SET hits=hits+1, last_used=? WHERE key=?", (time.time(), key))
+        except sqlite3.Error as e: log.error(f"Cache Save Error: {e}")
+        return row[0]
+
+    def __setitem__(self, key, cmd):
+        try:
+            self.conn.execute(
+                "INSERT INTO fixes (key, cmd, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET cmd=excluded.cmd, last_used=excluded.last_used",
+                (key, cmd, time.time()))
+        except sqlite3.Error as e: log.error(f"Cache Save Error: {e}")
+
+    def import_json(self, path):
+        """One-off migration from the old fix_cache.json (only into an empty DB)."""
+        if self.conn.execute("SELECT 1 FROM fixes").fetchone(): return
+        with open(path, 'rb') as f: data = orjson.loads(f.read())
+        data.pop("prompts", None) # Old per-prompt memo; FIX_CACHE[problem_key] already covers it
+        for key, cmd in data.items(): self[key] = cmd
+        log.info(f"Imported {len(data)} fixes from {path}")
+
+FIX_CACHE = FixCache(CACHE_DB)
 if os.path.exists(CACHE_FILE):
-    try:
-        with open(CACHE_FILE, 'r') as f: FIX_CACHE = json.load(f)
-    except: FIX_CACHE = {}
+    try: FIX_CACHE.import_json(CACHE_FILE)
+    except Exception as e: log.error(f"Cache Import Error: {e}")
 
 # State
-SYSTEM_STATE = {"nas": "ok", "cpu": "ok", "mem": "ok", "disk": "ok", "containers": {}}
-ERROR_BACKOFF = {"active": False, "wait_min": 5, "next_try": 0}
+class CircuitBreaker:
+    """
+    closed    -> calls allowed; AI_FAILURES_TO_OPEN failures in a row opens it.
+    open      -> calls refused until the cooldown elapses.
+    half_open -> one probe call allowed; success closes, failure re-opens (longer cooldown).
+    """
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0
+        self.wait_min = AI_COOLDOWN_MIN
 
-# --- Helper Functions ---
+    def allow(self):
+        if self.state == "open" and time.time() - self.opened_at >= self.wait_min * 60:
+            self.state = "half_open"
+            return True
+        return self.state == "closed"
 
-def save_cache():
-    """Saves the learned fixes to disk."""
-    try:
-        with open(CACHE_FILE, 'w') as f: json.dump(FIX_CACHE, f)
-    except Exception as e: print(f"Cache Save Error: {e}")
+    def record_success(self):
+        self.state, self.failures, self.wait_min = "closed", 0, AI_COOLDOWN_MIN
+
+    def record_failure(self):
+        """Returns the cooldown (minutes) if this failure opened the breaker, else None."""
+        self.failures += 1
+        if self.state == "half_open":
+            self.wait_min = min(self.wait_min * 2, AI_COOLDOWN_MAX)
+        elif self.failures < AI_FAILURES_TO_OPEN:
+            return None
+        self.state, self.opened_at = "open", time.time()
+        return self.wait_min
+
+OK, ERR = 0, 1 # Health flags (so any(...) over checks means "something is wrong")
+SYSTEM_STATE = {"probe": OK, "nas": OK, "cockpit": OK, "cpu": OK, "mem": OK, "disk": OK, "containers": {}}
+AI_BREAKER = CircuitBreaker()
+# 2 providers x 2 hedges: cancel() can't stop a running call, so a timed-out hedge
+# may still hold its workers (up to AI_TIMEOUT) when the next check asks the AI
+AI_POOL = ThreadPoolExecutor(max_workers=4)
+TG_QUEUE = queue.Queue()
+TG_BACKLOG = deque(maxlen=TG_BACKLOG_MAX)
+TG_PAUSED_UNTIL = 0
+TG_FAILURES = 0
+
+# --- Helper Functions ---
 
 def run_host_cmd(cmd):
-    """Run shell command on host."""
-    full = f'nsenter -t 1 -m -u -n -i sh -c "{cmd}"'
+    """
+    Run shell command on host (cmd is passed verbatim to the host's sh, no local shell).
+    Only the first MAX_CMD_OUTPUT bytes of stdout+stderr are kept; the rest is drained and dropped.
+    Returns within CMD_TIMEOUT even if a detached child keeps the pipe open; a timeout is a failure.
+    """
+    full = ["nsenter", "-t", "1", "-m", "-u", "-n", "-i", "sh", "-c", cmd]
     try:
-        res = subprocess.run(full, shell=True, capture_output=True, text=True, timeout=30)
-        return res.returncode == 0, res.stdout.strip() + " " + res.stderr.strip()
+        proc = subprocess.Popen(full, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+        output, killed = b"", False
+        deadline = time.monotonic() + CMD_TIMEOUT
+        with selectors.DefaultSelector() as sel:
+            sel.register(proc.stdout, selectors.EVENT_READ)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    killed = True
+                    break
+                if not sel.select(remaining): continue
+                data = os.read(proc.stdout.fileno(), 65536)
+                if not data: break # EOF
+                output += data[:MAX_CMD_OUTPUT - len(output)]
+        proc.stdout.close()
+        if not killed:
+            try: proc.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired: killed = True
+        if killed:
+            # Kill the whole group; anything that setsid()'d away is no longer our pipe's problem
+            try: os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError: pass
+            proc.wait()
+        output = output.decode(errors="replace").strip()
+        if killed: return False, f"{output} [killed after {CMD_TIMEOUT}s]".strip()
+        return proc.returncode == 0, output
     except Exception as e:
         return False, str(e)
 
 def send_msg(text):
-    """Send Telegram message and Log to Docker."""
+    """Log to Docker and queue the message for Telegram."""
     # 1. Log to Docker/Console (Essential for transparency)
-    print(f"[TELEGRAM] {text}")
+    log.info(f"[TELEGRAM] {text}")
     
-    # 2. Send to Telegram
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        requests.post(url, json={'chat_id': TELEGRAM_CHAT_ID, 'text': text, 'parse_mode': 'Markdown'}, timeout=10)
-    except Exception as e:
-        print(f"[TELEGRAM ERROR] Could not send to API: {e}")
+    # 2. Hand off to the sender thread (never blocks the monitor loop)
+    TG_QUEUE.put(text)
+
+def tg_post(text):
+    """
+    POST one message to Telegram. Returns False if it should be retried later,
+    in which case TG_PAUSED_UNTIL has been pushed out (429 retry_after or backoff).
+    """
+    global TG_PAUSED_UNTIL, TG_FAILURES
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    payload = {'chat_id': TELEGRAM_CHAT_ID, 'text': text, 'parse_mode': 'Markdown'}
+    while True:
+        try:
+            resp = TG_SESSION.post(url, json=payload, timeout=10)
+        except Exception as e:
+            resp = None
+            log.error(f"[TELEGRAM ERROR] Could not send to API: {e}")
+
+        if resp is not None and resp.status_code == 429:
+            try: retry_after = float(resp.json()["parameters"]["retry_after"])
+            except Exception: retry_after = 5 # Non-JSON body (e.g. a proxy) or no parameters
+            TG_PAUSED_UNTIL = time.time() + retry_after + 0.5
+            log.warning(f"[TELEGRAM] Rate limited, pausing sends for {retry_after}s")
+            return False
+        if resp is None or resp.status_code >= 500:
+            # Exponential backoff with jitter so we don't hammer a struggling API
+            TG_FAILURES += 1
+            delay = min(TG_BACKOFF_MAX, 2 ** TG_FAILURES) + random.uniform(0, 1)
+            TG_PAUSED_UNTIL = time.time() + delay
+            log.warning(f"[TELEGRAM] Send failed, retrying in {delay:.1f}s")
+            return False
+        if resp.status_code == 400 and "parse_mode" in payload:
+            # Joined messages can break Markdown; resend as plain text
+            del payload["parse_mode"]
+            continue
+        if resp.status_code != 200:
+            log.error(f"[TELEGRAM ERROR] Dropped message, HTTP {resp.status_code}: {resp.text[:200]}")
+        TG_FAILURES = 0
+        return True
+
+def send_pending():
+    """One sender pass: wait out any pause, then post the next batch."""
+    pause = TG_PAUSED_UNTIL - time.time()
+    if pause > 0: time.sleep(pause)
+
+    # Held-back messages first, then everything queued meanwhile, in order.
+    # Only this thread touches TG_BACKLOG; its maxlen drops the oldest on overflow.
+    while True:
+        try: TG_BACKLOG.append(TG_QUEUE.get_nowait())
+        except queue.Empty: break
+    if not TG_BACKLOG:
+        try: TG_BACKLOG.append(TG_QUEUE.get(timeout=1))
+        except queue.Empty: return
+    deadline = time.time() + TG_BATCH_WINDOW
+    while (remaining := deadline - time.time()) > 0:
+        try: TG_BACKLOG.append(TG_QUEUE.get(timeout=remaining))
+        except queue.Empty: break
+    batch = list(TG_BACKLOG)
+    TG_BACKLOG.clear()
+
+    # Join with blank lines, splitting only where Telegram's limit forces it
+    chunks = [""]
+    for text in batch:
+        text = text[:TG_MAX_LEN]
+        if chunks[-1] and len(chunks[-1]) + 2 + len(text) > TG_MAX_LEN:
+            chunks.append("")
+        chunks[-1] = f"{chunks[-1]}\n\n{text}" if chunks[-1] else text
+
+    for i, chunk in enumerate(chunks):
+        if not tg_post(chunk):
+            # Hold unsent chunks; they go out ahead of anything queued meanwhile
+            TG_BACKLOG.extend(chunks[i:])
+            break
+
+def telegram_sender():
+    """Background thread: coalesces bursts from TG_QUEUE into as few sends as possible."""
+    while True:
+        try:
+            send_pending()
+        except Exception as e:
+            # Never let the sender die, or every later alert piles up in TG_QUEUE
+            log.error(f"[TELEGRAM ERROR] Sender crashed: {e}")
+            time.sleep(5)
 
 # --- The "Intelligent" Core ---
 
+# Commands never run without a human (also anything the AI flags "MAJOR:")
+_DANGEROUS = re.compile(r'\b(rm|reboot|shutdown|mkfs|dd)\b')
+
 def intelligent_troubleshoot(problem_key, problem_desc):
     """
     1. Check Cache for known fix.
@@ -96,13 +323,11 @@ def intelligent_troubleshoot(problem_key, problem_desc):
     3. If fails (or no cache), Ask AI (Gemini -> failover -> ChatGPT).
     4. Execute & Update Cache.
     """
-    global FIX_CACHE
-    
     send_msg(f"⚠️ *Issue Detected*: {problem_desc}")
 
     # STEP 1: Check Cache (The "Memory")
-    if problem_key in FIX_CACHE:
-        cached_cmd = FIX_CACHE[problem_key]
+    cached_cmd = FIX_CACHE.get(problem_key)
+    if cached_cmd:
         send_msg(f"🧠 *Memory*: I know this issue. Trying learned fix:\n`{cached_cmd}`")
         
         success, output = run_host_cmd(cached_cmd)
@@ -121,13 +346,18 @@ def intelligent_troubleshoot(problem_key, problem_desc):
         send_msg(f"🛑 *AI Failure*: {ai_cmd}")
         return False
 
-    # Extract command (Simple parsing)
-    cmd = ai_cmd.split('\n')[-1].replace('MAJOR: ', '').strip()
-    is_major = "MAJOR:" in ai_cmd or "rm " in cmd or "reboot" in cmd
+    # Extract command (last line, optionally prefixed "MAJOR:")
+    answer = ai_cmd.rstrip()
+    cmd = answer[answer.rfind('\n') + 1:].strip().removeprefix("MAJOR:").strip()
+    is_major = "MAJOR:" in ai_cmd or bool(_DANGEROUS.search(cmd))
+    if not cmd:
+        send_msg(f"🛑 *AI Failure*: No command in answer:\n{ai_cmd[:200]}")
+        return False
     
-    # Approval? (Skip approval if we want full automation, but safer to ask for now)
-    # For this specific request "do it intelligent", we run it automatically IF it's not super dangerous
-    # OR we can just run it. Let's assume we run it for "intelligence".
+    # Approval: run automatically only if it's not dangerous, otherwise hand it to a human
+    if is_major:
+        send_msg(f"🚨 *Manual Action Needed*: AI suggests a risky fix, not running it:\n`{cmd}`")
+        return False
     
     send_msg(f"🤖 *AI Suggests*: `{cmd}`\nExecuting...")
     success, output = run_host_cmd(cmd)
@@ -136,97 +366,205 @@ def intelligent_troubleshoot(problem_key, problem_desc):
         send_msg(f"✅ *AI Fixed It*: {output[:200]}")
         # STEP 3: Learn (Update Cache)
         FIX_CACHE[problem_key] = cmd
-        save_cache()
         return True
     else:
         send_msg(f"❌ *AI Fix Failed*: {output[:200]}")
         return False
 
+SYS_PROMPT = "You are a Linux SysAdmin. Analyze the error. Output a brief diagnosis, then the last line MUST be the shell command to fix it. No markdown."
+
+def call_gemini(prompt):
+    """Single Gemini request. Raises on failure."""
+    global GEMINI_CALL_COUNT
+    GEMINI_CALL_COUNT += 1
+    log.info(f"[API] Gemini Call #{GEMINI_CALL_COUNT} initiated...")
+
+    response = gemini_client.models.generate_content(
+        model=MODEL_GEMINI,
+        contents=[f"System Prompt: {SYS_PROMPT}\nUser: {prompt}"]
+    )
+    return response.text.strip()
+
+def call_openai(prompt):
+    """Single ChatGPT request. Raises on failure."""
+    global OPENAI_CALL_COUNT
+    OPENAI_CALL_COUNT += 1
+    log.info(f"[API] OpenAI Call #{OPENAI_CALL_COUNT} initiated...")
+
+    response = openai_client.chat.completions.create(
+        model=MODEL_GPT,
+        messages=[
+            {"role": "system", "content": SYS_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        timeout=AI_TIMEOUT
+    )
+    return response.choices[0].message.content.strip()
+
+def hedge_ai(prompt):
+    """
+    Hedged request: Gemini starts alone; ChatGPT is only launched if Gemini
+    fails or hasn't answered within HEDGE_DELAY. First good answer wins (or None).
+    """
+    gemini = AI_POOL.submit(call_gemini, prompt)
+    done, _ = wait([gemini], timeout=HEDGE_DELAY)
+    if done and gemini.exception() is None:
+        return gemini.result()
+    if done:
+        log.warning(f"Gemini Failed: {gemini.exception()}")
+        send_msg("⚠️ Gemini failed. Switching to ChatGPT...")
+    else:
+        log.info(f"[API] Gemini slower than {HEDGE_DELAY}s, hedging with ChatGPT...")
+
+    futures = {AI_POOL.submit(call_openai, prompt): "OpenAI"}
+    if not done: futures[gemini] = "Gemini"
+    pending = set(futures)
+    deadline = time.time() + AI_TIMEOUT
+    while pending:
+        done, pending = wait(pending, timeout=max(0, deadline - time.time()), return_when=FIRST_COMPLETED)
+        if not done:
+            log.warning(f"AI Hedge timed out after {AI_TIMEOUT}s")
+            break
+        for f in done:
+            if f.exception() is None:
+                for loser in pending: loser.cancel()
+                log.info(f"AI Hedge won by {futures[f]}")
+                return f.result()
+            log.warning(f"{futures[f]} Failed: {f.exception()}")
+    for f in pending: f.cancel()
+    return None
+
 def ask_ai_hybrid(prompt):
-    """Tries Gemini, falls back to ChatGPT."""
-    global ERROR_BACKOFF
-    
-    # Backoff Check
-    if ERROR_BACKOFF["active"] and time.time() < ERROR_BACKOFF["next_try"]:
+    """Tries Gemini, hedges/falls back to ChatGPT."""
+    # Circuit Breaker Check
+    if not AI_BREAKER.allow():
         return "ERROR: AI Cooling Down"
 
-    sys_prompt = "You are a Linux SysAdmin. Analyze the error. Output a brief diagnosis, then the last line MUST be the shell command to fix it. No markdown."
-    
-    global GEMINI_CALL_COUNT
-    
-    # 1. Try Gemini
-    try:
-        GEMINI_CALL_COUNT += 1
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] [API] Gemini Call #{GEMINI_CALL_COUNT} initiated...")
-        
-        response = gemini_client.models.generate_content(
-            model=MODEL_GEMINI,
-            contents=[f"System Prompt: {sys_prompt}\nUser: {prompt}"]
-        )
-        return response.text.strip()
-    except Exception as e:
-        print(f"Gemini Failed: {e}")
-    
-    # 2. Try OpenAI (Fallback)
+    answer = None
     if openai_client:
-        global OPENAI_CALL_COUNT
+        # 1. Gemini first, ChatGPT as hedge/fallback
+        answer = hedge_ai(prompt)
+    else:
+        # 2. Gemini only
         try:
-            send_msg("⚠️ Gemini failed. Switching to ChatGPT...")
-            OPENAI_CALL_COUNT += 1
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] [API] OpenAI Call #{OPENAI_CALL_COUNT} initiated...")
-
-            response = openai_client.chat.completions.create(
-                model=MODEL_GPT,
-                messages=[
-                    {"role": "system", "content": sys_prompt},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            return response.choices[0].message.content.strip()
+            answer = call_gemini(prompt)
         except Exception as e:
-            print(f"OpenAI Failed: {e}")
-
-    # 3. All Failed -> Trigger Backoff
-    wait = ERROR_BACKOFF["wait_min"]
-    send_msg(f"💀 All AIs Dead. Sleeping {wait} mins.")
-    ERROR_BACKOFF["active"] = True
-    ERROR_BACKOFF["next_try"] = time.time() + (wait * 60)
-    ERROR_BACKOFF["wait_min"] *= 2 
+            log.warning(f"Gemini Failed: {e}")
+
+    if answer:
+        if AI_BREAKER.state == "half_open": send_msg("✅ AI is reachable again.")
+        AI_BREAKER.record_success()
+        return answer
+
+    # 3. All Failed -> Trip the Breaker
+    wait_min = AI_BREAKER.record_failure()
+    if wait_min: send_msg(f"💀 All AIs Dead. Sleeping {wait_min} mins.")
     return "ERROR: Unavailable"
 
 # --- Monitoring Loop ---
 
+# One shell script, one nsenter: each section is announced by a ===NAME=== marker
+PROBE_SCRIPT = (
+    "echo ===COCKPIT===; systemctl is-active cockpit.service; "
+    "echo ===MEM===; free -m; "
+    "echo ===CPU===; cat /proc/loadavg; "
+    "echo ===DISK===; df -P /"
+)
+_PROBE_MARKER = re.compile(r'^===(\w+)===$', re.MULTILINE)
+
+def nas_mount_line():
+    """Host mountinfo entry for the NAS ('' if not mounted). Never touches the mount itself."""
+    with open(HOST_MOUNTINFO) as f:
+        # Field 5 is the mount point
+        return next((line.strip() for line in f if line.split()[4] == NAS_MOUNT_POINT), "")
+
+def probe_all():
+    """Collect every host probe in a single nsenter call. Returns {section: output}."""
+    # Exit code only reflects the last section; each section is judged on its own output
+    _, output = run_host_cmd(PROBE_SCRIPT)
+    parts = _PROBE_MARKER.split(output)
+    probes = {name: body.strip() for name, body in zip(parts[1::2], parts[2::2])}
+    if not probes:
+        # No markers at all: nsenter/sh itself failed, so every host check is blind
+        log.error(f"[TASK] Host probe failed: {output[:200]}")
+        if SYSTEM_STATE["probe"] == OK:
+            SYSTEM_STATE["probe"] = ERR
+            send_msg(f"🛑 *Host Probe Failed*: can't check cockpit/CPU/memory/disk.\n{output[:200]}")
+    elif SYSTEM_STATE["probe"] == ERR:
+        SYSTEM_STATE["probe"] = OK
+        send_msg("✅ Host probe is working again.")
+    # NAS: read the mount table, no subprocess and no stat() on a possibly hung mount
+    try:
+        probes["NAS"] = nas_mount_line()
+    except OSError as e:
+        log.error(f"Mountinfo Error: {e}")
+    return probes
+
+def _mem_ok(out):
+    # Mem: total used free shared buff/cache available
+    for line in out.splitlines():
+        if line.startswith("Mem:"):
+            f = line.split()
+            return (int(f[1]) - int(f[6])) * 100 / int(f[1]) <= MEM_USED_MAX
+    return True
+
+def _disk_ok(out):
+    # Filesystem 1024-blocks Used Available Capacity Mounted-on
+    for line in out.splitlines():
+        f = line.split()
+        if f and f[-1] == "/":
+            return int(f[4].rstrip('%')) <= DISK_USED_MAX
+    return True
+
+# (key, probe section, state field, failure description, healthy(output) -> bool, auto_fix)
+# auto_fix=False means alert only: resource pressure is never handed to AI-run commands
+HEALTH_CHECKS = [
+    ("nas_down", "NAS", "nas", f"NAS at {NAS_MOUNT_POINT} is not mounted.",
+     lambda out: bool(out), True),
+    ("cockpit_down", "COCKPIT", "cockpit", "Service 'cockpit' is inactive.",
+     lambda out: out == "active", True),
+    ("cpu_high", "CPU", "cpu", f"CPU load average is above {CPU_LOAD_MAX}.",
+     lambda out: float(out.split()[0]) <= CPU_LOAD_MAX, False),
+    ("mem_high", "MEM", "mem", f"Memory usage is above {MEM_USED_MAX}%.", _mem_ok, False),
+    ("disk_high", "DISK", "disk", f"Root filesystem usage is above {DISK_USED_MAX}%.", _disk_ok, False),
+]
+
 def check_system():
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] [TASK] Starting system health check...")
-    
-    # 1. NAS Check
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] [TASK] Checking NAS mount ({NAS_MOUNT_POINT})...")
-    is_mounted, _ = run_host_cmd(f"mount | grep '{NAS_MOUNT_POINT}'")
-    if not is_mounted:
-        if SYSTEM_STATE["nas"] == "ok":
-            SYSTEM_STATE["nas"] = "error"
-            # Trigger Intelligent Fix
-            # Key: "nas_down" ensures we cache the fix for this specific problem
-            fixed = intelligent_troubleshoot("nas_down", f"NAS at {NAS_MOUNT_POINT} is not mounted.")
-            if fixed: SYSTEM_STATE["nas"] = "ok"
-    else:
-        if SYSTEM_STATE["nas"] == "error":
-            SYSTEM_STATE["nas"] = "ok"
-            send_msg("✅ NAS is back online.")
-
-    # 2. Service Check (Cockpit example)
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] [TASK] Checking 'cockpit' service...")
-    is_active, _ = run_host_cmd("systemctl is-active cockpit.service")
-    if not is_active:
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] [TASK] 'cockpit' service is DOWN. Troubleshooting...")
-        fixed = intelligent_troubleshoot("cockpit_down", "Service 'cockpit' is inactive.")
-    else:
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] [TASK] 'cockpit' service is OK.")
+    log.info("[TASK] Starting system health check...")
+
+    # 1. Gather every probe in one host round-trip
+    probes = probe_all()
+
+    # 2. React serially (fixes may interact with each other)
+    for key, section, field, desc, healthy, auto_fix in HEALTH_CHECKS:
+        if section not in probes:
+            log.error(f"[TASK] No '{section}' probe output, skipping.")
+            continue
+        try:
+            ok = healthy(probes[section])
+        except (ValueError, IndexError, ZeroDivisionError) as e:
+            log.warning(f"[TASK] Could not parse '{section}' probe: {e}")
+            continue
+
+        if not ok:
+            if SYSTEM_STATE[field] == OK:
+                SYSTEM_STATE[field] = ERR
+                if not auto_fix:
+                    send_msg(f"⚠️ *Issue Detected*: {desc}")
+                    continue
+                log.info(f"[TASK] '{field}' check FAILED. Troubleshooting...")
+                # Key ensures we cache the fix for this specific problem
+                fixed = intelligent_troubleshoot(key, desc)
+                if fixed: SYSTEM_STATE[field] = OK
+        else:
+            if SYSTEM_STATE[field] == ERR:
+                SYSTEM_STATE[field] = OK
+                send_msg(f"✅ `{field}` is back to normal.")
 
-    # (Add CPU/Mem checks here following same pattern...)
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] [TASK] System check complete.")
+    log.info("[TASK] System check complete.")
 
 def main():
+    threading.Thread(target=telegram_sender, name="telegram", daemon=True).start()
     send_msg("🧠 *Intelligent Monitor V3 Started*\nFeatures: Cache Memory + Multi-AI Failover")
     
     # Ensure data dir exists for cache
@@ -243,7 +581,7 @@ def main():
             
         except KeyboardInterrupt: break
         except Exception as e:
-            print(f"Loop Error: {e}")
+            log.error(f"Loop Error: {e}")
             time.sleep(POLL_INTERVAL)
 
 if __name__ == "__main__":